@@ -1,4 +1,7 @@
-import argparse, sys, subprocess, tempfile, shutil
+import argparse, os, sys, subprocess
+from collections import deque
+from multiprocessing import Pool, shared_memory
+from functools import lru_cache
 from pathlib import Path
 import numpy as np, cv2, json
 
@@ -8,47 +11,175 @@ def grid_dimensions(width, height, block_size, gutter):
     rows = height // cell
     return cols, rows
 
-def extract_frames_from_video(video_path, out_frames_dir, fps=60):
-    out_frames_dir = Path(out_frames_dir); out_frames_dir.mkdir(parents=True, exist_ok=True)
-    cmd = ["ffmpeg", "-y", "-i", str(video_path), "-r", str(fps), str(out_frames_dir/"frame_%06d.png")]
-    print("Running ffmpeg to extract frames:", " ".join(cmd))
-    subprocess.check_call(cmd)
-    return sorted(out_frames_dir.glob("frame_*.png"))
+def read_frame_into(stream, out):
+    # fill out completely from stream, False at the end of the stream (a partial trailing frame is dropped)
+    view = memoryview(out).cast('B')
+    got = 0
+    while got < len(view):
+        n = stream.readinto(view[got:])
+        if not n:
+            return False
+        got += n
+    return True
 
-def decode_frames_to_bytes(frame_paths, width, height, block_size, gutter):
+def iter_video_frames(video_path, ring, free, fps=60):
+    # stream raw gray frames from ffmpeg straight into free (H, W) slots of ring and yield each filled slot,
+    # the caller keeps free non-empty; ffmpeg crops each frame (on the gray plane, 4:2:0 would round odd
+    # sizes) to the ring's width x height so unused margins never reach the pipe
+    height, width = ring.shape[1:]
+    cmd = ["ffmpeg", "-i", str(video_path), "-r", str(fps), "-vf", f"format=gray,crop={width}:{height}:0:0",
+           "-f", "rawvideo", "-pix_fmt", "gray", "-"]
+    print("Running ffmpeg to decode video:", " ".join(cmd))
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=1<<20)
+    try:
+        while True:
+            slot = free.popleft()
+            if not read_frame_into(proc.stdout, ring[slot]):
+                free.appendleft(slot)
+                break
+            yield slot
+    finally:
+        proc.stdout.close()
+        ret = proc.wait()
+    if ret:
+        raise subprocess.CalledProcessError(ret, cmd)
+
+@lru_cache(maxsize=None)
+def precompute_block_coords(width, height, block_size, gutter):
+    # sample rectangle of every (block, bit) as int32 arrays of shape (rows*cols, 8),
+    # fixed for the whole video so it is built once and reused for every frame
     cols, rows = grid_dimensions(width, height, block_size, gutter)
     cell = block_size + gutter
+    B = block_size
+    stripe_w = max(1, B // 8)
+    total_stripes_w = stripe_w * 8
+    idx = np.arange(cols*rows)[:, None]
+    bit = np.arange(8)[None, :]
+    x0 = (idx % cols) * cell; y0 = (idx // cols) * cell
+    sx = x0 + (B - total_stripes_w) // 2
+    x_stripe0 = sx + bit * stripe_w
+    x_stripe1 = x_stripe0 + stripe_w
+    xs = x_stripe0 + stripe_w//2
+    xs0 = np.maximum(x_stripe0, xs-1); xs1 = np.minimum(x_stripe1, xs+2)
+    ys0 = np.maximum(y0 + 1, 0); ys1 = np.minimum(y0 + B - 1, height)
+    coords = tuple(np.ascontiguousarray(np.broadcast_to(a, (cols*rows, 8)), dtype=np.int32)
+                   for a in (xs0, xs1, ys0, ys1))
+    for a in coords:
+        a.flags.writeable = False
+    return coords
+
+@lru_cache(maxsize=None)
+def precompute_sample_counts(width, height, block_size, gutter):
+    xs0, xs1, ys0, ys1 = precompute_block_coords(width, height, block_size, gutter)
+    counts = (np.clip(ys1 - ys0, 0, None) * np.clip(xs1 - xs0, 0, None)).astype(np.uint32)
+    counts.flags.writeable = False
+    return counts
+
+@lru_cache(maxsize=None)
+def precompute_thresholds(width, height, block_size, gutter):
+    # a bit is set when its sample mean is above 127.5, i.e. sum*2 > count*255;
+    # for integer sums that is sum > count*255 // 2, one uint32 compare per (block, bit)
+    counts = precompute_sample_counts(width, height, block_size, gutter)
+    thresholds = (counts * 255) // 2
+    thresholds.flags.writeable = False
+    return thresholds
+
+@lru_cache(maxsize=None)
+def make_frame_decoder(width, height, block_size, gutter, stripe_bits=1, frame_width=None):
+    # decoder specialized for one video's geometry and frame stride: the summed-area table offsets of
+    # every sample corner are flattened once, so a frame is 4 gathers, a compare and a packbits
+    frame_width = width if frame_width is None else frame_width
+    xs0, xs1, ys0, ys1 = precompute_block_coords(width, height, block_size, gutter)
+    stride = frame_width + 1
+    i11, i01, i10, i00 = (y.astype(np.intp) * stride + x for y, x in ((ys1, xs1), (ys0, xs1), (ys1, xs0), (ys0, xs0)))
+    if stripe_bits == 1:
+        thresholds = precompute_thresholds(width, height, block_size, gutter)
+    else:
+        # nearest of the 2**stripe_bits levels, round(sum / (count*step)), then undo the gray code
+        step = 255 // ((1 << stripe_bits) - 1)
+        scale = precompute_sample_counts(width, height, block_size, gutter) * np.uint32(step)
+        divisor = np.maximum(2*scale, 1)
+        top = (1 << stripe_bits) - 1
+    def decode(gray):
+        # summed-area table padded with a zero row/column, every rectangle sum is 4 lookups;
+        # cv2.integral builds it in OpenCV's vectorized C++ (differences stay exact under wraparound)
+        S = cv2.integral(gray, sdepth=cv2.CV_32S).view(np.uint32).ravel()
+        sums = S.take(i11); sums -= S.take(i01); sums -= S.take(i10); sums += S.take(i00)
+        if stripe_bits == 1:
+            return np.packbits(sums > thresholds, axis=1, bitorder='big').tobytes()
+        symbols = np.minimum((2*sums + scale) // divisor, top).astype(np.uint8)
+        symbols ^= symbols >> 1; symbols ^= symbols >> 2; symbols ^= symbols >> 4
+        bits = np.unpackbits(symbols.reshape(-1, 1), axis=1, bitorder='big')[:, 8 - stripe_bits:]
+        return np.packbits(bits.reshape(-1, 8), axis=1, bitorder='big').tobytes()
+    return decode
+
+def decode_frame(gray, width, height, block_size, gutter, stripe_bits=1):
+    return make_frame_decoder(width, height, block_size, gutter, stripe_bits, gray.shape[1])(gray)
+
+def _decode_path(args):
+    # pool worker: load one frame image and decode it
+    fp, width, height, block_size, gutter, stripe_bits = args
+    img = cv2.imread(str(fp))
+    if img is None:
+        raise RuntimeError(f"Failed to load {fp}")
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return decode_frame(gray, width, height, block_size, gutter, stripe_bits=stripe_bits)
+
+def decode_frames_to_bytes(frame_paths, width, height, block_size, gutter, processes=None, stripe_bits=1):
+    # frames are intra-only and independent, decode them across processes and write each
+    # one into its slot of an output buffer allocated once for the known frame count
+    cols, rows = grid_dimensions(width, height, block_size, gutter)
+    bytes_per_frame = cols * rows * stripe_bits
+    recovered = bytearray(len(frame_paths) * bytes_per_frame)
+    tasks = [(fp, width, height, block_size, gutter, stripe_bits) for fp in frame_paths]
+    with Pool(processes or os.cpu_count() or 1) as pool:
+        for i, frame_bytes in enumerate(pool.imap(_decode_path, tasks, chunksize=4)):
+            recovered[i*bytes_per_frame:(i+1)*bytes_per_frame] = frame_bytes
+    return recovered
+
+_ring = None  # this worker's view of the shared frame ring
+_ring_shm = None
+
+def _attach_ring(name, shape):
+    # pool initializer: map the main process's shared (slots, H, W) frame ring into this worker
+    global _ring, _ring_shm
+    _ring_shm = shared_memory.SharedMemory(name=name)
+    _ring = np.ndarray(shape, dtype=np.uint8, buffer=_ring_shm.buf)
+
+def _decode_slot(args):
+    # pool worker: decode the raw gray frame in one ring slot, only the decoded bytes go back
+    slot, width, height, block_size, gutter, stripe_bits = args
+    return decode_frame(_ring[slot], width, height, block_size, gutter, stripe_bits=stripe_bits)
+
+def decode_video_to_bytes(video_path, width, height, block_size, gutter, fps=60, processes=None, stripe_bits=1):
+    # ffmpeg's frames are read straight into a shared-memory ring and decoded across processes from there,
+    # so raw frames are never copied or pickled; a slot is refilled only after its frame is decoded.
+    # the frame count isn't known up front so the output grows, without a final bytes() copy
     recovered = bytearray()
-    for fp in frame_paths:
-        img = cv2.imread(str(fp))
-        if img is None:
-            raise RuntimeError(f"Failed to load {fp}")
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        B = block_size
-        stripe_w = max(1, B // 8)
-        total_stripes_w = stripe_w * 8
-        for idx in range(cols*rows):
-            r = idx // cols
-            c = idx % cols
-            x0 = c * cell; y0 = r * cell
-            sx = x0 + (B - total_stripes_w) // 2
-            byte = 0
-            for bit in range(8):
-                x_stripe0 = sx + bit * stripe_w
-                x_stripe1 = x_stripe0 + stripe_w
-                xs = x_stripe0 + stripe_w//2
-                ys0 = y0 + 1; ys1 = y0 + B - 1
-                xs0 = max(x_stripe0, xs-1); xs1 = min(x_stripe1, xs+2)
-                ys0 = max(ys0, 0); ys1 = min(ys1, gray.shape[0])
-                if xs0 >= xs1 or ys0 >= ys1:
-                    sample_val = 0
-                else:
-                    sample_region = gray[ys0:ys1, xs0:xs1]
-                    sample_val = int(sample_region.mean()) if sample_region.size>0 else 0
-                bitval = 1 if sample_val > 127 else 0
-                byte = (byte << 1) | bitval
-            recovered.append(byte)
-    return bytes(recovered)
+    processes = processes or os.cpu_count() or 1
+    cols, rows = grid_dimensions(width, height, block_size, gutter)
+    cell = block_size + gutter
+    # only the block grid is sampled, so ask ffmpeg for just that area
+    shape = (max(4, 2 * processes), rows*cell, cols*cell)
+    shm = shared_memory.SharedMemory(create=True, size=shape[0] * shape[1] * shape[2])
+    ring = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        with Pool(processes, initializer=_attach_ring, initargs=(shm.name, shape)) as pool:
+            free = deque(range(shape[0]))
+            pending = deque()
+            for slot in iter_video_frames(video_path, ring, free, fps=fps):
+                pending.append((slot, pool.apply_async(_decode_slot, ((slot, width, height, block_size, gutter, stripe_bits),))))
+                if not free:
+                    slot, result = pending.popleft()
+                    recovered += result.get()
+                    free.append(slot)
+            while pending:
+                slot, result = pending.popleft()
+                recovered += result.get()
+    finally:
+        del ring
+        shm.close(); shm.unlink()
+    return recovered
 
 def main():
     p = argparse.ArgumentParser()
@@ -59,32 +190,22 @@ def main():
     p.add_argument("--block",type=int,default=8)
     p.add_argument("--gutter",type=int,default=1)
     p.add_argument("--fps",type=int,default=60)
+    p.add_argument("--stripe-bits",type=int,choices=[1, 2, 4, 8],default=None,
+                   help="defaults to the manifest's stripe_bits, else 1")
     args = p.parse_args()
 
     inpath = Path(args.inpath)
-    tempdir = None
-    frames_dir = None
-    if inpath.is_file() and inpath.suffix.lower() in {".webm", ".mp4", ".mkv", ".mov"}:
-        tempdir = tempfile.mkdtemp(prefix="ytstore_frames_")
-        try:
-            frame_paths = extract_frames_from_video(inpath, Path(tempdir), fps=args.fps)
-            frames_dir = Path(tempdir)
-        except Exception as e:
-            print("ffmpeg extraction failed:", e); sys.exit(1)
-    elif inpath.is_dir():
-        frames_dir = inpath
-        frame_paths = sorted(frames_dir.glob("frame_*.png"))
-    else:
+    is_video = inpath.is_file() and inpath.suffix.lower() in {".webm", ".mp4", ".mkv", ".mov"}
+    if not is_video and not inpath.is_dir():
         print("Input must be a video file or a frames directory.")
         sys.exit(1)
 
-    if not frame_paths:
-        print("No frames found to decode.")
-        sys.exit(1)
-
-    # try to load manifest if present next to frames_dir
+    # try to load manifest if present next to the frames dir, or next to the video (the encoder's outdir)
     manifest = None
-    mpath = frames_dir.parent / "manifest.json" if (frames_dir.name == "frames") else frames_dir / "manifest.json"
+    if is_video:
+        mpath = inpath.parent / "manifest.json"
+    else:
+        mpath = inpath.parent / "manifest.json" if (inpath.name == "frames") else inpath / "manifest.json"
     if mpath.exists():
         try:
             manifest = json.loads(mpath.read_text())
@@ -92,7 +213,33 @@ def main():
         except:
             manifest = None
 
-    data = decode_frames_to_bytes(frame_paths, args.width, args.height, args.block, args.gutter)
+    # decoding with the wrong stripe depth silently produces garbage, so the manifest's value wins
+    # when the flag is left out and a conflicting flag is an error
+    stripe_bits = args.stripe_bits
+    if manifest and "stripe_bits" in manifest:
+        if stripe_bits is not None and stripe_bits != manifest["stripe_bits"]:
+            print(f"--stripe-bits {stripe_bits} does not match the manifest's stripe_bits {manifest['stripe_bits']}.")
+            sys.exit(1)
+        stripe_bits = manifest["stripe_bits"]
+    stripe_bits = stripe_bits or 1
+
+    if is_video:
+        try:
+            data = decode_video_to_bytes(inpath, args.width, args.height, args.block, args.gutter,
+                                         fps=args.fps, stripe_bits=stripe_bits)
+        except Exception as e:
+            print("ffmpeg decoding failed:", e); sys.exit(1)
+        if not data:
+            print("No frames found to decode.")
+            sys.exit(1)
+    else:
+        frame_paths = sorted(inpath.glob("frame_*.png"))
+        if not frame_paths:
+            print("No frames found to decode.")
+            sys.exit(1)
+        data = decode_frames_to_bytes(frame_paths, args.width, args.height, args.block, args.gutter,
+                                      stripe_bits=stripe_bits)
+
     if manifest and "file_length" in manifest:
         trimmed = data[:manifest["file_length"]]
     else:
@@ -100,8 +247,5 @@ def main():
     Path(args.outfile).write_bytes(trimmed)
     print("Wrote recovered", len(trimmed), "bytes to", args.outfile)
 
-    if tempdir:
-        shutil.rmtree(tempdir)
-
 if __name__ == '__main__':
     main()
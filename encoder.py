@@ -5,11 +5,26 @@ Options (env args or CLI):
   --block (default 8)
   --gutter (default 1)
   --fps (default 60)
-  --crf (default 10)
+  --crf (default 10, only used by libvpx-vp9)
+  --stripe-bits (default 1: bits per stripe, 2/4/8 use 4/16/256 full range gray levels,
+                 needs hevc_nvenc or libsvtav1, refused with the lossy libvpx-vp9)
+  --codec (default auto: hevc_nvenc, then libsvtav1 lossless, else libvpx-vp9)
+  --save-frames (also write the rendered frames as PNGs to <outdir>/frames)
 """
-import argparse, math, json, subprocess, os
+import argparse, json, subprocess, os, sys
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+from multiprocessing import Pool, shared_memory
 from pathlib import Path
 import numpy as np, cv2
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+BATCH_FRAMES = 4  # frames handed to ffmpeg per write
+FRAME_BUFFERS = 2 * BATCH_FRAMES  # frames rendered ahead, one batch being written while the next is rendered
 
 def grid_dimensions(width, height, block_size, gutter):
     cell = block_size + gutter
@@ -17,61 +32,194 @@ def grid_dimensions(width, height, block_size, gutter):
     rows = height // cell
     return cols, rows
 
-def render_frame_from_payload(frame_index, payload_bytes, width, height, block_size, gutter):
+def stripe_symbols(chunk, stripe_bits):
+    # split bytes into stripe_bits-wide symbols (MSB first), gray coded so one level of error flips one bit
+    if stripe_bits == 1:
+        return np.unpackbits(chunk, bitorder='big')
+    bits = np.unpackbits(chunk, bitorder='big').reshape(-1, stripe_bits)
+    symbols = np.packbits(bits, axis=1, bitorder='big').ravel() >> (8 - stripe_bits)
+    return symbols ^ (symbols >> 1)
+
+@lru_cache(maxsize=None)
+def make_frame_renderer(width, height, block_size, gutter, stripe_bits=1):
+    # renderer specialized for one video's geometry: every size, offset and the stripe level scratch
+    # buffer is fixed once here, so a frame is just unpack, scale and one strided write
     W = width; H = height; B = block_size; G = gutter
     cols, rows = grid_dimensions(W, H, B, G)
     cell = B + G
-    img = np.zeros((H, W, 3), dtype=np.uint8)  # black background
     max_blocks = cols * rows
-    for idx, b in enumerate(payload_bytes):
-        if idx >= max_blocks: break
-        r = idx // cols
-        c = idx % cols
-        x0 = c * cell
-        y0 = r * cell
-        stripe_w = max(1, B // 8)
-        total_stripe_area_w = stripe_w * 8
-        sx = x0 + (B - total_stripe_area_w) // 2
-        for bit in range(8):
-            bitval = (b >> (7-bit)) & 1
-            color = 255 if bitval else 0
-            x_stripe0 = sx + bit * stripe_w
-            x_stripe1 = x_stripe0 + stripe_w
-            img[y0:y0+B, x_stripe0:x_stripe1, :] = color
+    max_bytes = max_blocks * stripe_bits
+    stripe_w = max(1, B // 8)
+    total_stripe_area_w = stripe_w * 8
+    sx = (B - total_stripe_area_w) // 2
+    level_step = 255 // ((1 << stripe_bits) - 1)
+    # one row of 8 stripe levels per block (stripe_bits bytes per block), reused between frames
+    levels = np.zeros(max_blocks * 8, dtype=np.uint8)
+    def render(payload_bytes, out):
+        out.fill(0)
+        chunk = np.frombuffer(payload_bytes, dtype=np.uint8, count=min(len(payload_bytes), max_bytes))
+        symbols = stripe_symbols(chunk, stripe_bits)
+        n = len(symbols)
+        np.multiply(symbols, level_step, out=levels[:n])
+        levels[n:] = 0  # unused blocks stay black
+        stripes = levels.reshape(rows, cols, 8)
+        if stripe_w > 1:
+            stripes = np.repeat(stripes, stripe_w, axis=2)
+        # view the used area as (rows, cell, cols, cell) so every block is written at once
+        cells = out[:rows*cell, :cols*cell].reshape(rows, cell, cols, cell)
+        cells[:, :B, :, sx:sx+total_stripe_area_w] = stripes[:, None, :, :]
+        return out
+    return render
+
+def render_frame_from_payload(frame_index, payload_bytes, width, height, block_size, gutter, out=None, stripe_bits=1):
+    # out, when given, is the caller's (H, W) uint8 buffer reused between frames
+    if out is None:
+        out = np.zeros((height, width), dtype=np.uint8)  # black background, single gray plane
+    render = make_frame_renderer(width, height, block_size, gutter, stripe_bits)
     # small frame marker (not necessary)
-    return img
+    return render(payload_bytes, out)
 
-def encode_file_to_frames(infile, out_dir, width, height, block_size, gutter):
-    out_dir = Path(out_dir); frames_dir = out_dir / "frames"; frames_dir.mkdir(parents=True, exist_ok=True)
-    data = Path(infile).read_bytes()
-    cols, rows = grid_dimensions(width, height, block_size, gutter)
-    blocks_per_frame = cols * rows
-    frames_needed = math.ceil(len(data) / blocks_per_frame)
-    frame_paths = []
-    for f in range(frames_needed):
-        start = f * blocks_per_frame; end = start + blocks_per_frame
-        chunk = data[start:end]
-        img = render_frame_from_payload(f, chunk, width, height, block_size, gutter)
-        fname = frames_dir / f"frame_{f:06d}.png"
-        cv2.imwrite(str(fname), img)
-        frame_paths.append(fname)
-    return frame_paths, len(data)
-
-def assemble_video_with_ffmpeg(frames_dir, out_video, fps=60, crf=10):
-    cmd = [
+def iter_payload_chunks(data, bytes_per_frame):
+    for start in range(0, len(data), bytes_per_frame):
+        yield data[start:start+bytes_per_frame]
+
+# output flags per video codec, the lossless intra-only ones are tried fastest first
+CODECS = {
+    "hevc_nvenc": ["-c:v", "hevc_nvenc", "-preset", "p1", "-tune", "lossless", "-rc", "constqp", "-qp", "0", "-g", "1"],
+    # ffmpeg's libsvtav1 wrapper treats -crf 0 as unset, lossless=1 is what makes this lossless
+    "libsvtav1": ["-c:v", "libsvtav1", "-preset", "12", "-crf", "0", "-svtav1-params", "tune=0:lossless=1"],
+    "libvpx-vp9": ["-c:v", "libvpx-vp9", "-b:v", "0", "-g", "300"],  # lossy, gets -crf
+}
+CONTAINERS = {"hevc_nvenc": ".mkv"}  # webm can't carry hevc
+
+def codec_works(codec):
+    # encoders can be listed by `ffmpeg -encoders` without usable hardware, and older builds reject some
+    # of the lossless flags, so encode one test frame with the exact flags the real encode uses
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "color=black:s=256x256:d=0.1",
+           "-frames:v", "1", "-pix_fmt", "yuv420p"] + CODECS[codec] + ["-f", "null", "-"]
+    try:
+        return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+def pick_codec():
+    for codec in ("hevc_nvenc", "libsvtav1"):
+        if codec_works(codec):
+            return codec
+    return "libvpx-vp9"
+
+def ffmpeg_cmd(out_video, width, height, fps=60, crf=10, codec="libvpx-vp9", stripe_bits=1):
+    codec_args = CODECS[codec] + (["-crf", str(crf)] if codec == "libvpx-vp9" else [])
+    # gray input is full range and yuv420p defaults to limited range, which shifts some of the
+    # 2**stripe_bits levels off by one; keep the video full range so every level survives
+    range_args = ["-vf", "scale=in_range=full:out_range=full", "-color_range", "pc"] if stripe_bits > 1 else []
+    return [
         "ffmpeg", "-y",
+        "-f", "rawvideo",
+        "-pix_fmt", "gray",
+        "-s", f"{width}x{height}",
         "-framerate", str(fps),
-        "-i", str(frames_dir / "frame_%06d.png"),
-        "-c:v", "libvpx-vp9",
+        "-i", "-",
+        *range_args,
+        *codec_args,
         "-pix_fmt", "yuv420p",
-        "-b:v", "0",
-        "-crf", str(crf),
-        "-g", "300",
         str(out_video)
     ]
-    print("Running ffmpeg to assemble video (this may take time):")
+
+def grow_pipe(fd, size=1<<24):
+    # larger pipe so short ffmpeg stalls don't block the writer, capped by /proc/sys/fs/pipe-max-size
+    F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", None)
+    while F_SETPIPE_SZ is not None and size >= 1<<16:
+        try:
+            fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+            return
+        except OSError:
+            size //= 2
+
+def write_frames(stream, frames):
+    # one writev() per batch of frame buffers where available, resuming after partial writes
+    if not hasattr(os, "writev"):
+        for frame in frames:
+            stream.write(frame)
+        return
+    stream.flush()
+    fd = stream.fileno()
+    views = [memoryview(frame).cast('B') for frame in frames]
+    while views:
+        n = os.writev(fd, views)
+        while views and n >= len(views[0]):
+            n -= len(views[0]); views.pop(0)
+        if views:
+            views[0] = views[0][n:]
+
+_ring = None  # this worker's view of the shared frame ring
+_ring_shm = None
+
+def _attach_ring(name, shape):
+    # pool initializer: map the main process's shared (slots, H, W) frame ring into this worker
+    global _ring, _ring_shm
+    _ring_shm = shared_memory.SharedMemory(name=name)
+    _ring = np.ndarray(shape, dtype=np.uint8, buffer=_ring_shm.buf)
+
+def _render(args):
+    # pool worker: draw one frame straight into its ring slot, only the slot index goes back
+    slot, frame_index, chunk, width, height, block_size, gutter, stripe_bits = args
+    render_frame_from_payload(frame_index, chunk, width, height, block_size, gutter, out=_ring[slot], stripe_bits=stripe_bits)
+    return slot
+
+def iter_rendered_frames(pool, free, data, width, height, block_size, gutter, stripe_bits=1):
+    # yields ring slots holding frames in order; a slot is only reused once the caller puts it back
+    # on free, so the ring size caps how many frames are rendered ahead
+    cols, rows = grid_dimensions(width, height, block_size, gutter)
+    pending = deque()
+    for f, chunk in enumerate(iter_payload_chunks(data, cols * rows * stripe_bits)):
+        while not free:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(_render, ((free.popleft(), f, chunk, width, height, block_size, gutter, stripe_bits),)))
+    while pending:
+        yield pending.popleft().get()
+
+def encode_file_to_video(infile, out_video, width, height, block_size, gutter, fps=60, crf=10, frames_dir=None, processes=None,
+                         codec="libvpx-vp9", stripe_bits=1):
+    data = Path(infile).read_bytes()
+    if frames_dir is not None:
+        frames_dir = Path(frames_dir); frames_dir.mkdir(parents=True, exist_ok=True)
+    processes = processes or os.cpu_count() or 1
+
+    # ring of preallocated frame buffers in shared memory: workers render into a slot and the main
+    # process writes that slot to ffmpeg as is, so frames are never copied or pickled
+    shape = (max(FRAME_BUFFERS, 2 * processes), height, width)
+    shm = shared_memory.SharedMemory(create=True, size=shape[0] * height * width)
+    ring = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+    cmd = ffmpeg_cmd(out_video, width, height, fps=fps, crf=crf, codec=codec, stripe_bits=stripe_bits)
+    print("Running ffmpeg to encode video (this may take time):")
     print(" ".join(cmd))
-    subprocess.check_call(cmd)
+    frame_count = 0
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, bufsize=1<<20)
+        grow_pipe(proc.stdin.fileno())
+        try:
+            # frames only depend on their own payload slice, so they render in parallel across processes
+            with Pool(processes, initializer=_attach_ring, initargs=(shm.name, shape)) as pool:
+                free = deque(range(shape[0]))
+                frames = iter_rendered_frames(pool, free, data, width, height, block_size, gutter, stripe_bits=stripe_bits)
+                while batch := list(islice(frames, BATCH_FRAMES)):
+                    if frames_dir is not None:
+                        for i, slot in enumerate(batch):
+                            cv2.imwrite(str(frames_dir / f"frame_{frame_count + i:06d}.png"), ring[slot])
+                    write_frames(proc.stdin, [ring[slot] for slot in batch])
+                    free.extend(batch)
+                    frame_count += len(batch)
+        finally:
+            proc.stdin.close()
+            ret = proc.wait()
+    finally:
+        del ring
+        shm.close(); shm.unlink()
+    if ret:
+        raise subprocess.CalledProcessError(ret, cmd)
+    return frame_count, len(data)
 
 def main():
     p = argparse.ArgumentParser()
@@ -82,33 +230,54 @@ def main():
     p.add_argument("--block",type=int,default=8)
     p.add_argument("--gutter",type=int,default=1)
     p.add_argument("--fps",type=int,default=60)
-    p.add_argument("--crf",type=int,default=10)
+    p.add_argument("--crf",type=int,default=None)
+    p.add_argument("--stripe-bits",type=int,choices=[1, 2, 4, 8],default=1)
+    p.add_argument("--codec",choices=["auto", *CODECS],default="auto")
+    p.add_argument("--save-frames",action="store_true")
     args = p.parse_args()
 
-    frames, orig_len = encode_file_to_frames(args.input, args.outdir, args.width, args.height, args.block, args.gutter)
+    codec = pick_codec() if args.codec == "auto" else args.codec
+    if args.stripe_bits > 1 and codec == "libvpx-vp9":
+        # vp9 here is lossy, the gray levels would decode to corrupt bytes
+        print("--stripe-bits > 1 needs a lossless codec (hevc_nvenc or libsvtav1), not libvpx-vp9.")
+        sys.exit(1)
+    if codec == "libvpx-vp9":
+        crf = 10 if args.crf is None else args.crf
+    else:
+        crf = None  # the lossless codecs have no quality knob
+        if args.crf is not None:
+            print(f"Warning: --crf is ignored with the lossless {codec}.")
+    outdir = Path(args.outdir); outdir.mkdir(parents=True, exist_ok=True)
+    out_video = outdir / ("encoded" + CONTAINERS.get(codec, ".webm"))
+    frames_dir = outdir / "frames" if args.save_frames else None
+    try:
+        frames, orig_len = encode_file_to_video(args.input, out_video, args.width, args.height, args.block, args.gutter,
+                                                fps=args.fps, crf=crf, frames_dir=frames_dir, codec=codec,
+                                                stripe_bits=args.stripe_bits)
+    except Exception as e:
+        print("ffmpeg encoding failed or ffmpeg not present. Error:", e)
+        sys.exit(1)
+    print("Video encoded at:", out_video)
+    if frames_dir is not None:
+        print(f"Wrote {frames} frames to {frames_dir}")
+
     manifest = {
         "input_file": str(args.input),
         "file_length": orig_len,
-        "frames": len(frames),
+        "frames": frames,
         "width": args.width,
         "height": args.height,
         "block_size": args.block,
         "gutter": args.gutter,
+        "stripe_bits": args.stripe_bits,
         "fps": args.fps,
-        "crf": args.crf
+        "codec": codec
     }
-    manifest_path = Path(args.outdir) / "manifest.json"
-    with open(manifest_path, "w") as f:
-        json.dump(manifest, f, indent=2)
-    print(f"Wrote {len(frames)} frames to {args.outdir}/frames and manifest to {manifest_path}")
-
-    # assemble video
-    out_video = Path(args.outdir) / "encoded.webm"
-    try:
-        assemble_video_with_ffmpeg(Path(args.outdir)/"frames", out_video, fps=args.fps, crf=args.crf)
-        print("Video assembled at:", out_video)
-    except Exception as e:
-        print("ffmpeg assembly failed or ffmpeg not present. Frames are available. Error:", e)
+    if crf is not None:
+        manifest["crf"] = crf
+    manifest_path = outdir / "manifest.json"
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    print("Wrote manifest to", manifest_path)
 
 if __name__ == '__main__':
     main()
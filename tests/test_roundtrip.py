@@ -0,0 +1,45 @@
+import os, shutil, sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import encoder, decoder
+
+# software lossless hevc stands in for hevc_nvenc/libsvtav1, which need hardware or a newer ffmpeg
+LOSSLESS = ["-c:v", "libx265", "-x265-params", "lossless=1:log-level=none"]
+WIDTH, HEIGHT, BLOCK, GUTTER = 320, 180, 8, 1
+
+@pytest.fixture
+def lossless_codec(monkeypatch):
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg not on path")
+    monkeypatch.setitem(encoder.CODECS, "libx265", LOSSLESS)
+    if not encoder.codec_works("libx265"):
+        pytest.skip("ffmpeg has no libx265")
+    return "libx265"
+
+@pytest.mark.parametrize("stripe_bits", [1, 2, 4, 8])
+def test_video_roundtrip(tmp_path, lossless_codec, stripe_bits):
+    data = os.urandom(20000)
+    infile = tmp_path / "input.bin"; infile.write_bytes(data)
+    out_video = tmp_path / "encoded.mkv"
+    encoder.encode_file_to_video(infile, out_video, WIDTH, HEIGHT, BLOCK, GUTTER, processes=2,
+                                 codec=lossless_codec, stripe_bits=stripe_bits)
+    recovered = decoder.decode_video_to_bytes(out_video, WIDTH, HEIGHT, BLOCK, GUTTER, processes=2,
+                                              stripe_bits=stripe_bits)
+    assert bytes(recovered[:len(data)]) == data
+
+@pytest.mark.parametrize("stripe_bits", [1, 2, 4, 8])
+@pytest.mark.parametrize("width, height, block_size, gutter", [(320, 180, 8, 1), (1917, 1079, 8, 1), (333, 211, 24, 3)])
+def test_frame_roundtrip(stripe_bits, width, height, block_size, gutter):
+    # render -> decode in-process, no ffmpeg: a full frame and a short final chunk
+    cols, rows = encoder.grid_dimensions(width, height, block_size, gutter)
+    bytes_per_frame = cols * rows * stripe_bits
+    for length in (bytes_per_frame, bytes_per_frame // 3 + 1):
+        payload = os.urandom(length)
+        img = encoder.render_frame_from_payload(0, payload, width, height, block_size, gutter, stripe_bits=stripe_bits)
+        assert img.shape == (height, width)
+        recovered = decoder.decode_frame(img, width, height, block_size, gutter, stripe_bits=stripe_bits)
+        assert len(recovered) == bytes_per_frame
+        assert recovered[:length] == payload
+        assert recovered[length:] == bytes(bytes_per_frame - length)